@@ -0,0 +1,109 @@
+import asyncio
+
+
+class MicroBatcher:
+
+	def __init__(self, run_batch, max_batch_size, max_batch_delay):
+		"""
+		Groups the requests arriving within a short time window, so they are processed by a single batched call.
+		:param run_batch: Coroutine function taking a list of inputs and returning a list of outputs in the same order
+		:param max_batch_size: Maximum number of inputs in a batch
+		:param max_batch_delay: Time in seconds to wait for other inputs once the first one arrived
+		"""
+		self.run_batch = run_batch
+		self.max_batch_size = max_batch_size
+		self.max_batch_delay = max_batch_delay
+		self.queue = None
+		self.worker = None
+		self.close_exception = None
+
+	async def submit(self, input_data):
+		"""
+		Queues an input and waits until the batch containing it is processed.
+		:param input_data: A single input
+		:return: The output corresponding to the input
+		"""
+		if self.worker is None:
+			# created lazily so that they are bound to the event loop running the requests
+			self.queue = asyncio.Queue()
+			self.worker = asyncio.ensure_future(self.process())
+		future = asyncio.get_event_loop().create_future()
+		self.queue.put_nowait((input_data, future))
+		return await future
+
+	async def process(self):
+		"""
+		Waits for inputs, and runs them in batches of at most max_batch_size inputs.
+		An input arriving while nothing else is queued is run right away, the batch only waits max_batch_delay for
+		more inputs when several requests are already queued.
+		"""
+		while True:
+			batch = [await self.queue.get()]
+			try:
+				self.fill(batch)
+				if 1 < len(batch) < self.max_batch_size and self.max_batch_delay > 0:
+					await asyncio.sleep(self.max_batch_delay)
+					self.fill(batch)
+				await self.dispatch(batch)
+			except asyncio.CancelledError:
+				# the batcher was closed, the requests of the batch are aborted
+				for _, future in batch:
+					self.abort(future)
+				raise
+
+	def fill(self, batch):
+		"""
+		Adds the already queued inputs to the batch without exceeding max_batch_size.
+		:param batch: List of (input, future) tuples
+		"""
+		while len(batch) < self.max_batch_size and not self.queue.empty():
+			batch.append(self.queue.get_nowait())
+
+	async def dispatch(self, batch):
+		"""
+		Runs a batch and resolves the future of each input.
+		In case the batch fails, its inputs are run one by one so that an invalid input only fails its own request.
+		:param batch: List of (input, future) tuples
+		"""
+		# requests cancelled while queued (e.g. the client disconnected) are not run
+		batch = [entry for entry in batch if not entry[1].done()]
+		if not batch:
+			return
+		try:
+			outputs = await self.run_batch([input_data for input_data, _ in batch])
+		except asyncio.CancelledError:
+			# the batcher was closed, it must not be retried one by one
+			raise
+		except Exception as e:
+			if len(batch) > 1:
+				for entry in batch:
+					await self.dispatch([entry])
+			elif not batch[0][1].done():
+				batch[0][1].set_exception(e)
+			return
+		for (_, future), output in zip(batch, outputs):
+			if not future.done():
+				future.set_result(output)
+
+	def close(self, exception=None):
+		"""
+		Stops processing inputs, and aborts the requests that are still queued or running.
+		:param exception: Exception the aborted requests fail with, they are cancelled in case it's None
+		"""
+		self.close_exception = exception
+		if self.worker is not None:
+			self.worker.cancel()
+			while not self.queue.empty():
+				self.abort(self.queue.get_nowait()[1])
+
+	def abort(self, future):
+		"""
+		Fails the future of a request with the closing exception, or cancels it.
+		:param future: Future of the request
+		"""
+		if future.done():
+			return
+		if self.close_exception is None:
+			future.cancel()
+		else:
+			future.set_exception(self.close_exception)
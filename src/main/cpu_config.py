@@ -0,0 +1,49 @@
+"""
+CPU settings shared by the launcher and the API workers.
+
+tensorflow reads its thread pool sizes once, when the first session is created, so they have to be set before any
+model is loaded. Defaults follow Intel's guidance: one intra op thread per physical core and a single inter op thread.
+The physical cores are split between the uvicorn workers so that they don't oversubscribe the cpu. The settings are
+applied when this module is first imported, that is once per process.
+"""
+import os
+
+
+def _physical_core_cpus():
+	"""
+	Lists one logical cpu per physical core this process is allowed to run on, SMT siblings are left out.
+	:return: Set of logical cpu ids, empty in case the cpu topology can't be read
+	"""
+	cpus = {}
+	try:
+		for cpu in sorted(os.sched_getaffinity(0)):
+			topology = '/sys/devices/system/cpu/cpu{}/topology/'.format(cpu)
+			with open(topology + 'physical_package_id') as package_id, open(topology + 'core_id') as core_id:
+				cpus.setdefault((package_id.read().strip(), core_id.read().strip()), cpu)
+	except (AttributeError, OSError):
+		return set()
+	return set(cpus.values())
+
+
+physical_core_cpus = _physical_core_cpus()
+physical_cores = len(physical_core_cpus) or os.cpu_count() or 1
+workers = int(os.environ.get('WORKERS', 0))
+intra_op_threads = int(os.environ.get('TF_INTRA_OP_THREADS', 0))
+if not workers:
+	workers = max(1, physical_cores // intra_op_threads) if intra_op_threads else 1
+if not intra_op_threads:
+	intra_op_threads = max(1, physical_cores // workers)
+inter_op_threads = int(os.environ.get('TF_INTER_OP_THREADS', 1))
+os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+os.environ.setdefault('KMP_BLOCKTIME', '0')
+# running on SMT siblings slows inference down, the process (and the workers it spawns) is restricted to one logical
+# cpu per physical core
+if physical_core_cpus and os.environ.get('PIN_PHYSICAL_CORES', '1') == '1':
+	os.sched_setaffinity(0, physical_core_cpus)
+# OpenMP binds the threads of every process starting from the same first core, so binding is only enabled for a
+# single worker. Several workers share the physical cores through the OS scheduler, or can be given disjoint cores
+# by starting one container per core set (docker run --cpuset-cpus).
+if workers == 1:
+	os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+	os.environ.setdefault('OMP_PROC_BIND', 'close')
+	os.environ.setdefault('OMP_PLACES', 'cores')
@@ -2,6 +2,7 @@ import os
 import re
 import json
 import uuid
+import fcntl
 from inference.inference_engines_factory import InferenceEngineFactory
 from inference.exceptions import ModelNotFound, InvalidModelConfiguration, ModelNotLoaded, InferenceEngineNotFound, \
     InvalidInputData, ApplicationError
@@ -9,22 +10,24 @@ from inference.exceptions import ModelNotFound, InvalidModelConfiguration, Model
 
 class DeepLearningService:
 
-    def __init__(self):
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, use_int8=False):
         """
         Sets the models base directory, and initializes some dictionaries.
         Saves the loaded model's hashes to a json file, so the values are saved even though the API went down.
+        :param intra_op_threads: Number of threads used to parallelize a single operation, 0 lets the framework decide
+        :param inter_op_threads: Number of operations executed in parallel, 0 lets the framework decide
+        :param use_int8: Boolean to load the int8 quantized variant of the models when they provide one
         """
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.use_int8 = use_int8
         # dictionary to hold the model instances (model_name: string -> model_instance: AbstractInferenceEngine)
         self.models_dict = {}
         # read from json file and append to dict
         file_name = '/models_hash/model_hash.json'
         file_exists = os.path.exists(file_name)
         if file_exists:
-            try:
-                with open(file_name) as json_file:
-                    self.models_hash_dict = json.load(json_file)
-            except:
-                self.models_hash_dict = {}
+            self.models_hash_dict = self.read_models_hash() or {}
         else:
             with open('/models_hash/model_hash.json', 'w'):
                 self.models_hash_dict = {}
@@ -43,11 +46,26 @@ class DeepLearningService:
             return True
         model_path = os.path.join(self.base_models_dir, model_name)
         try:
-            self.models_dict[model_name] = InferenceEngineFactory.get_engine(model_path)
+            self.models_dict[model_name] = InferenceEngineFactory.get_engine(model_path,
+                                                                            intra_op_threads=self.intra_op_threads,
+                                                                            inter_op_threads=self.inter_op_threads,
+                                                                            use_int8=self.use_int8)
             return True
         except ApplicationError as e:
             raise e
 
+    def read_models_hash(self):
+        """
+        Reads the models hashes from the json file. The file is shared by the API workers, which read it again to
+        pick up the hashes generated by the other workers.
+        :return: Dictionary of model names and their hashed values, None in case the file can't be read
+        """
+        try:
+            with open('/models_hash/model_hash.json') as json_file:
+                return json.load(json_file)
+        except:
+            return None
+
     def load_all_models(self):
         """
         Loads all the available models.
@@ -55,15 +73,22 @@ class DeepLearningService:
         """
         self.load_models(self.list_models())
         models = self.list_models()
-        for model in models:
-            if model not in self.models_hash_dict:
-                self.models_hash_dict[model] = str(uuid.uuid4())
-        for key in list(self.models_hash_dict):
-            if key not in models:
-                del self.models_hash_dict[key]
-        # append to json file
-        with open('/models_hash/model_hash.json', "w") as fp:
-            json.dump(self.models_hash_dict, fp)
+        # the file is shared by the API workers, the lock keeps them from generating different hashes for the same
+        # model between reading and writing the file
+        with open('/models_hash/model_hash.json.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # keep the hashes another worker may have generated since this one read the file
+            self.models_hash_dict.update(self.read_models_hash() or {})
+            for model in models:
+                if model not in self.models_hash_dict:
+                    self.models_hash_dict[model] = str(uuid.uuid4())
+            for key in list(self.models_hash_dict):
+                if key not in models:
+                    del self.models_hash_dict[key]
+            # written to a temporary file and renamed, so that the other workers never read a partially written file
+            with open('/models_hash/model_hash.json.tmp', "w") as fp:
+                json.dump(self.models_hash_dict, fp)
+            os.replace('/models_hash/model_hash.json.tmp', '/models_hash/model_hash.json')
         return self.models_hash_dict
 
     def load_models(self, model_names):
@@ -79,25 +104,18 @@ class DeepLearningService:
         """
         Loads the model in case it was never loaded and calls the inference engine class to get a prediction.
         :param model_name: Model name
-        :param input_data: Batch of images or a single image
+        :param input_data: Batch of images or a single image, as RGB numpy arrays
         :param draw: Boolean to specify if we need to draw the response on the input image
         :param predict_batch: Boolean to specify if there is a batch of images in a request or not
         :return: Model response in case draw was set to False, else an actual image
         """
-        if re.match(r'[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}', model_name,
-                    flags=0):
-            for key, value in self.models_hash_dict.items():
-                if value == model_name:
-                    model_name = key
+        model_name = self.resolve(model_name)
         if self.model_loaded(model_name):
             try:
                 if predict_batch:
                     return await self.models_dict[model_name].run_batch(input_data, draw, predict_batch)
                 else:
-                    if not draw:
-                        return await self.models_dict[model_name].infer(input_data, draw, predict_batch)
-                    else:
-                        await self.models_dict[model_name].infer(input_data, draw, predict_batch)
+                    return await self.models_dict[model_name].infer(input_data, draw, predict_batch)
             except ApplicationError as e:
                 raise e
         else:
@@ -107,6 +125,37 @@ class DeepLearningService:
             except ApplicationError as e:
                 raise e
 
+    def resolve(self, model_name):
+        """
+        Returns the model name corresponding to a model hash.
+        :param model_name: Model name or model hash
+        :return: Model name
+        """
+        if re.match(r'[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}', model_name,
+                    flags=0):
+            if model_name not in self.models_hash_dict.values():
+                # the hash may have been generated by another worker, the known hashes are kept if the file can't be read
+                models_hash = self.read_models_hash()
+                if models_hash is not None:
+                    self.models_hash_dict = models_hash
+            for key, value in self.models_hash_dict.items():
+                if value == model_name:
+                    return key
+        return model_name
+
+    def get_callable(self, model_name):
+        """
+        Loads the model in case it was never loaded and returns its prediction function, bound to the loaded model.
+        The function is synchronous and runs the whole prediction, so it can be called from a worker thread.
+        It has to be fetched again after the model is reloaded.
+        :param model_name: Model name or model hash
+        :return: Function taking a list of RGB images as numpy arrays and returning a list of responses
+        """
+        model_name = self.resolve(model_name)
+        if not self.model_loaded(model_name):
+            self.load_model(model_name)
+        return self.models_dict[model_name].predict
+
     def list_models(self):
         """
         Lists all the available models.
@@ -140,16 +189,13 @@ class DeepLearningService:
         :param model_name: Model name
         :return: A list of mode's labels with their hashed values
         """
-        if re.match(r'[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}', model_name,
-                    flags=0):
-            for key, value in self.models_hash_dict.items():
-                if value == model_name:
-                    model_name = key
+        model_name = self.resolve(model_name)
         models = self.list_models()
         if model_name not in self.labels_hash_dict:
             model_dict = {}
+            # derived from the model and label names, so that every worker returns the same hashes
             for label in self.models_dict[model_name].labels:
-                model_dict[label] = str(uuid.uuid4())
+                model_dict[label] = str(uuid.uuid5(uuid.NAMESPACE_URL, '{}/{}'.format(model_name, label)))
             self.labels_hash_dict[model_name] = model_dict
         for key in list(self.labels_hash_dict):
             if key not in models:
@@ -1,5 +1,8 @@
+import queue
+import atexit
 import logging
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from abc import ABC, abstractmethod
 
 
@@ -9,6 +12,7 @@ class AbstractError(ABC):
         """
         Sets the logger file, level, and format.
         The logging file will contain the logging level, request date, request status, and model response.
+        Records are only queued by the requests, a background thread writes them to the logging file.
         """
         self.logger = logging.getLogger('logger')
         date = datetime.now().strftime('%Y-%m-%d')
@@ -16,31 +20,40 @@ class AbstractError(ABC):
         self.handler = logging.FileHandler(file_path)
         self.handler.setLevel(logging.INFO)
         self.handler.setFormatter(logging.Formatter("%(levelname)s;%(asctime)s;%(message)s"))
-        self.logger.addHandler(self.handler)
+        self.listener = QueueListener(queue.Queue(-1), self.handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        self.logger.addHandler(QueueHandler(self.listener.queue))
 
     @abstractmethod
-    def info(self, message):
+    def info(self, message, *args):
         """
         Logs an info message to the logging file.
+        The message is only formatted with the arguments in case the record is actually logged.
         :param message: Containing the request status and the model response
+        :param args: Arguments merged into the message
         :return:
         """
         pass
 
     @abstractmethod
-    def warning(self, message):
+    def warning(self, message, *args):
         """
         Logs a warning message to the logging file.
+        The message is only formatted with the arguments in case the record is actually logged.
         :param message: Containing the request status and the model response
+        :param args: Arguments merged into the message
         :return:
         """
         pass
 
     @abstractmethod
-    def error(self, message):
+    def error(self, message, *args):
         """
         Logs an Error message to the logging file.
+        The message is only formatted with the arguments in case the record is actually logged.
         :param message: Containing the request status and the model response
+        :param args: Arguments merged into the message
         :return:
         """
         pass
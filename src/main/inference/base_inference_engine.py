@@ -4,15 +4,21 @@ from inference.exceptions import InvalidModelConfiguration, ModelNotLoaded, Appl
 
 class AbstractInferenceEngine(ABC):
 
-	def __init__(self, model_path):
+	def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0, use_int8=False):
 		"""
 		Takes a model path and calls the load function.
 		:param model_path: The model's path
+		:param intra_op_threads: Number of threads used to parallelize a single operation, 0 lets the framework decide
+		:param inter_op_threads: Number of operations executed in parallel, 0 lets the framework decide
+		:param use_int8: Boolean to load the int8 quantized variant of the model when it provides one
 		:return:
 		"""
 		self.labels = []
 		self.configuration = {}
 		self.model_path = model_path
+		self.intra_op_threads = intra_op_threads
+		self.inter_op_threads = inter_op_threads
+		self.use_int8 = use_int8
 		try:
 			self.validate_configuration()
 		except ApplicationError as e:
@@ -46,9 +52,9 @@ class AbstractInferenceEngine(ABC):
 		Performs the required inference based on the underlying implementation of this class.
 		Could be used to return classification predictions, object detection coordinates...
 		:param predict_batch: Boolean
-		:param input_data: A single image
+		:param input_data: A single RGB image as a numpy array
 		:param draw: Used to draw bounding boxes on image instead of returning them
-		:return: A bounding-box
+		:return: A bounding-box, or the image with the bounding boxes drawn on it in case draw was set to True
 		"""
 		pass
 
@@ -57,12 +63,22 @@ class AbstractInferenceEngine(ABC):
 		"""
 		Iterates over images and returns a prediction for each one.
 		:param predict_batch: Boolean
-		:param input_data: List of images
+		:param input_data: List of RGB images as numpy arrays
 		:param draw: Used to draw bounding boxes on image instead of returning them
 		:return: List of bounding-boxes
 		"""
 		pass
 
+	@abstractmethod
+	def predict(self, input_data):
+		"""
+		Synchronously returns a prediction for each image, without drawing.
+		Runs the whole prediction in the calling thread, so it can be executed outside of the event loop.
+		:param input_data: List of RGB images as numpy arrays
+		:return: List of bounding-boxes
+		"""
+		pass
+
 	@abstractmethod
 	def validate_configuration(self):
 		"""
@@ -12,17 +12,20 @@ class Error(AbstractError):
         self.date = None
         super().__init__()
 
-    def info(self, message):
-        self.check_date()
-        self.logger.info(message)
+    def info(self, message, *args):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.check_date()
+            self.logger.info(message, *args)
 
-    def warning(self, message):
-        self.check_date()
-        self.logger.warning(message)
+    def warning(self, message, *args):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.check_date()
+            self.logger.warning(message, *args)
 
-    def error(self, message):
-        self.check_date()
-        self.logger.error(message)
+    def error(self, message, *args):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.check_date()
+            self.logger.error(message, *args)
 
     def check_date(self):
         """
@@ -33,11 +36,12 @@ class Error(AbstractError):
         self.date = datetime.now().strftime('%Y-%m-%d')
         file_path = self.date + '.log'
         if file_path not in os.listdir('logs'):
-            self.logger.removeHandler(self.handler)
+            previous_handler = self.handler
             self.handler = logging.FileHandler('logs/' + file_path)
             self.handler.setLevel(logging.INFO)
             self.handler.setFormatter(logging.Formatter("%(levelname)s;%(asctime)s;%(message)s"))
-            self.logger.addHandler(self.handler)
+            self.listener.handlers = (self.handler,)
+            previous_handler.close()
         oldest_log_file = os.listdir('logs')[0]
         oldest_date = oldest_log_file.split('.')[0]
         a = datetime.strptime(datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d')
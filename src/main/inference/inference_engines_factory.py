@@ -6,10 +6,13 @@ from inference.exceptions import ModelNotFound, ApplicationError, InvalidModelCo
 class InferenceEngineFactory:
 
     @staticmethod
-    def get_engine(path_to_model):
+    def get_engine(path_to_model, intra_op_threads=0, inter_op_threads=0, use_int8=False):
         """
         Reads the model's inference engine from the model's configuration and calls the right inference engine class.
         :param path_to_model: Model's path
+        :param intra_op_threads: Number of threads used to parallelize a single operation
+        :param inter_op_threads: Number of operations executed in parallel
+        :param use_int8: Boolean to load the int8 quantized variant of the model when it provides one
         :return: The model's instance
         """
         if not os.path.exists(path_to_model):
@@ -25,7 +28,8 @@ class InferenceEngineFactory:
         try:
             # import one of the available inference engine class (in this project there's only one), and return a
             # model instance
-            return getattr(__import__(inference_engine_name), 'InferenceEngine')(path_to_model)
+            return getattr(__import__(inference_engine_name), 'InferenceEngine')(path_to_model, intra_op_threads,
+                                                                                inter_op_threads, use_int8)
         except ApplicationError as e:
             print(e)
             raise e
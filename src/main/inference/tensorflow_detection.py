@@ -1,18 +1,20 @@
 import os
 import jsonschema
 import asyncio
+import threading
 import json
+import cv2
 import numpy as np
 import tensorflow as tf
 from PIL import Image, ImageDraw, ImageFont
 from object_detection.utils import label_map_util
 from inference.base_inference_engine import AbstractInferenceEngine
-from inference.exceptions import InvalidModelConfiguration, InvalidInputData, ApplicationError
+from inference.exceptions import InvalidModelConfiguration, ApplicationError
 
 
 class InferenceEngine(AbstractInferenceEngine):
 
-	def __init__(self, model_path):
+	def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0, use_int8=False):
 		self.label_path = ""
 		self.NUM_CLASSES = None
 		self.sess = None
@@ -25,8 +27,11 @@ class InferenceEngine(AbstractInferenceEngine):
 		self.d_scores = None
 		self.d_classes = None
 		self.num_d = None
+		self.max_image_size = None
+		# per thread input buffers, reused across requests instead of allocating a new batch every time
+		self.buffers = threading.local()
 		self.font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-		super().__init__(model_path)
+		super().__init__(model_path, intra_op_threads, inter_op_threads, use_int8)
 
 	def load(self):
 		with open(os.path.join(self.model_path, 'config.json')) as f:
@@ -49,7 +54,7 @@ class InferenceEngine(AbstractInferenceEngine):
 		self.detection_graph = tf.Graph()
 		with self.detection_graph.as_default():
 			od_graph_def = tf.GraphDef()
-			with tf.gfile.GFile(os.path.join(self.model_path, 'frozen_inference_graph.pb'), 'rb') as fid:
+			with tf.gfile.GFile(self.graph_path(), 'rb') as fid:
 				serialized_graph = fid.read()
 				od_graph_def.ParseFromString(serialized_graph)
 				tf.import_graph_def(od_graph_def, name='')
@@ -58,7 +63,9 @@ class InferenceEngine(AbstractInferenceEngine):
 			self.d_scores = self.detection_graph.get_tensor_by_name('detection_scores:0')
 			self.d_classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
 			self.num_d = self.detection_graph.get_tensor_by_name('num_detections:0')
-		self.sess = tf.Session(graph=self.detection_graph)
+		session_config = tf.ConfigProto(intra_op_parallelism_threads=self.intra_op_threads,
+										inter_op_parallelism_threads=self.inter_op_threads)
+		self.sess = tf.Session(graph=self.detection_graph, config=session_config)
 		img = Image.open("object_detection/image1.jpg")
 		img_expanded = np.expand_dims(img, axis=0)
 		self.sess.run(
@@ -66,26 +73,118 @@ class InferenceEngine(AbstractInferenceEngine):
 			feed_dict={self.image_tensor: img_expanded})
 
 	async def infer(self, input_data, draw, predict_batch):
+		return (await self.run_batch([input_data], draw, predict_batch))[0]
+
+	async def run_batch(self, input_data, draw, predict_batch):
 		await asyncio.sleep(0.00001)
-		try:
-			pillow_image = Image.open(input_data.file).convert('RGB')
-			np_image = np.array(pillow_image)
-		except Exception as e:
-			raise InvalidInputData('corrupted image')
+		result_list = self.predict(input_data)
+		if draw:
+			result_list = [self.draw_image(Image.fromarray(np_image), response)
+						   for np_image, response in zip(input_data, result_list)]
+		return result_list
+
+	def predict(self, input_data):
+		json_confidence, json_predictions = self.read_thresholds()
+		detections = self.detect(input_data)
+		result_list = []
+		for np_image, (boxes, scores, classes) in zip(input_data, detections):
+			result_list.append(self.build_response(np_image, boxes, scores, classes, json_confidence, json_predictions))
+		return result_list
+
+	def read_thresholds(self):
+		"""
+		Reads the confidence and predictions values from config.json, so they can be changed while the API is running.
+		:return: Minimum confidence and maximum number of predictions
+		"""
 		try:
 			with open(self.model_path + '/config.json') as f:
 				data = json.load(f)
 		except Exception as e:
 			raise InvalidModelConfiguration('config.json not found or corrupted')
-		json_confidence = data['confidence']
-		json_predictions = data['predictions']
+		return data['confidence'], data['predictions']
+
+	def detect(self, images):
+		"""
+		Runs the detection graph on a list of images. Images having the same input shape are fed to the graph as a
+		single batch.
+		:param images: List of RGB images as numpy arrays
+		:return: List of (boxes, scores, classes) tuples in the same order as the images
+		"""
+		batches = {}
+		for index, np_image in enumerate(images):
+			batches.setdefault(self.input_shape(np_image), []).append(index)
+		detections = [None] * len(images)
 		with self.detection_graph.as_default():
+			for shape, indexes in batches.items():
+				batch = self.prepare_batch([images[index] for index in indexes], shape)
+				(boxes, scores, classes) = self.sess.run(
+					[self.d_boxes, self.d_scores, self.d_classes],
+					feed_dict={self.image_tensor: batch})
+				for position, index in enumerate(indexes):
+					detections[index] = (boxes[position], scores[position], classes[position])
+		return detections
+
+	def input_shape(self, np_image):
+		"""
+		Computes the shape of the image fed to the graph: its longest side is downscaled to fit in max_image_size.
+		The boxes are normalized, so they are scaled back to the original image size in build_response.
+		:param np_image: RGB image as a numpy array
+		:return: Input shape (height, width, depth)
+		"""
+		height, width, depth = np_image.shape
+		if not self.max_image_size or max(height, width) <= self.max_image_size:
+			return np_image.shape
+		scale = self.max_image_size / max(height, width)
+		return max(1, int(round(height * scale))), max(1, int(round(width * scale))), depth
+
+	def prepare_batch(self, images, shape):
+		"""
+		Builds the graph's input in a single pass: every image is resized (or copied) straight into its slot of the
+		batch, instead of being resized first and stacked afterwards.
+		:param images: List of RGB images as numpy arrays
+		:param shape: Input shape of all the images
+		:return: Batch of shape [len(images), height, width, depth]
+		"""
+		if len(images) == 1 and images[0].shape == shape:
 			# Expand dimension since the model expects image to have shape [1, None, None, 3].
-			img_expanded = np.expand_dims(np_image, axis=0)
-			(boxes, scores, classes, num) = self.sess.run(
-				[self.d_boxes, self.d_scores, self.d_classes, self.num_d],
-				feed_dict={self.image_tensor: img_expanded})
-		classes_names = ([self.category_index.get(i) for i in classes[0]])
+			return np.expand_dims(images[0], axis=0)
+		batch = self.input_buffer((len(images),) + shape)
+		for np_image, slot in zip(images, batch):
+			if np_image.shape == shape:
+				np.copyto(slot, np_image)
+			else:
+				cv2.resize(np_image, (shape[1], shape[0]), dst=slot, interpolation=cv2.INTER_LINEAR)
+		return batch
+
+	def input_buffer(self, shape):
+		"""
+		Returns a buffer for the graph's input. When max_image_size is set the size of the inputs is bounded, so the
+		calling thread keeps its buffer and reuses it for the next batches. The buffer is only grown when a bigger batch
+		comes in. The buffer can be reused as soon as the session run it was fed to returns.
+		:param shape: Batch shape
+		:return: Uninitialized uint8 array of the given shape
+		"""
+		if not self.max_image_size:
+			return np.empty(shape, dtype=np.uint8)
+		size = int(np.prod(shape))
+		buffer = getattr(self.buffers, 'input', None)
+		if buffer is None or buffer.size < size:
+			buffer = np.empty(size, dtype=np.uint8)
+			self.buffers.input = buffer
+		return buffer[:size].reshape(shape)
+
+	def build_response(self, np_image, boxes, scores, classes, json_confidence, json_predictions):
+		"""
+		Converts the raw detections of an image to bounding boxes.
+		:param np_image: The image the detections were made on
+		:param boxes: Normalized boxes
+		:param scores: Boxes scores
+		:param classes: Boxes classes ids
+		:param json_confidence: Minimum confidence of the returned boxes
+		:param json_predictions: Maximum number of returned boxes
+		:return: Bounding boxes response
+		"""
+		classes_names = ([self.category_index.get(i) for i in classes])
 		names_start = []
 		for name in classes_names:
 			if name is not None:
@@ -96,15 +195,15 @@ class InferenceEngine(AbstractInferenceEngine):
 		ids = []
 		bounding_boxes = []
 		for i in range(json_predictions):
-			if scores[0][i] * 100 >= json_confidence:
-				ymin = int(round(boxes[0][i][0] * height)) if int(round(boxes[0][i][0] * height)) > 0 else 0
-				xmin = int(round(boxes[0][i][1] * width)) if int(round(boxes[0][i][1] * height)) > 0 else 0
-				ymax = int(round(boxes[0][i][2] * height)) if int(round(boxes[0][i][2] * height)) > 0 else 0
-				xmax = int(round(boxes[0][i][3] * width)) if int(round(boxes[0][i][3] * height)) > 0 else 0
+			if scores[i] * 100 >= json_confidence:
+				ymin = int(round(boxes[i][0] * height)) if int(round(boxes[i][0] * height)) > 0 else 0
+				xmin = int(round(boxes[i][1] * width)) if int(round(boxes[i][1] * height)) > 0 else 0
+				ymax = int(round(boxes[i][2] * height)) if int(round(boxes[i][2] * height)) > 0 else 0
+				xmax = int(round(boxes[i][3] * width)) if int(round(boxes[i][3] * height)) > 0 else 0
 				tmp = dict([('left', xmin), ('top', ymin), ('right', xmax), ('bottom', ymax)])
 				bounding_boxes.append(tmp)
-				confidence.append(float(scores[0][i] * 100))
-				ids.append(int(classes[0][i]))
+				confidence.append(float(scores[i] * 100))
+				ids.append(int(classes[i]))
 				names.append(names_start[i])
 
 		responses_list = zip(names, confidence, bounding_boxes, ids)
@@ -114,35 +213,14 @@ class InferenceEngine(AbstractInferenceEngine):
 			tmp = dict([('ObjectClassName', response[0]), ('confidence', response[1]), ('coordinates', response[2]),
 						('ObjectClassId', response[3])])
 			output.append(tmp)
-		if predict_batch:
-			response = dict([('bounding-boxes', output), ('ImageName', input_data.filename)])
-		else:
-			response = dict([('bounding-boxes', output)])
-
-		if not draw:
-			return response
-		else:
-			try:
-				self.draw_image(pillow_image, response)
-			except ApplicationError as e:
-				raise e
-			except Exception as e:
-				raise e
-
-	async def run_batch(self, input_data, draw, predict_batch):
-		result_list = []
-		for image in input_data:
-			post_process = await self.infer(image, draw, predict_batch)
-			if post_process is not None:
-				result_list.append(post_process)
-		return result_list
+		return dict([('bounding-boxes', output)])
 
 	def draw_image(self, image, response):
 		"""
-		Draws on image and saves it.
+		Draws on image and returns it.
 		:param image: image of type pillow image
 		:param response: inference response
-		:return:
+		:return: The image with the bounding boxes drawn on it
 		"""
 		draw = ImageDraw.Draw(image)
 		for bbox in response['bounding-boxes']:
@@ -152,11 +230,22 @@ class InferenceEngine(AbstractInferenceEngine):
 			top = bbox['coordinates']['top']
 			conf = "{0:.2f}".format(bbox['confidence'])
 			draw.text((int(left), int(top) - 20), str(conf) + "% " + str(bbox['ObjectClassName']), 'red', self.font)
-		image.save('/main/result.jpg', 'PNG')
+		return image
 
 	def free(self):
 		pass
 
+	def graph_path(self):
+		"""
+		Returns the path of the graph to load: the int8 quantized graph in case int8 is enabled and the model provides
+		one, else the float graph.
+		:return: Path of the frozen graph
+		"""
+		int8_graph_path = os.path.join(self.model_path, 'frozen_inference_graph_int8.pb')
+		if self.use_int8 and os.path.exists(int8_graph_path):
+			return int8_graph_path
+		return os.path.join(self.model_path, 'frozen_inference_graph.pb')
+
 	def validate_configuration(self):
 		# check if weights file exists
 		if not os.path.exists(os.path.join(self.model_path, 'frozen_inference_graph.pb')):
@@ -171,6 +260,7 @@ class InferenceEngine(AbstractInferenceEngine):
 		self.configuration['type'] = data['type']
 		self.configuration['network'] = data['network']
 		self.NUM_CLASSES = data['number_of_classes']
+		self.max_image_size = data.get('max_image_size')
 
 	def validate_json_configuration(self, data):
 		with open(os.path.join('inference', 'ConfigurationSchema.json')) as f:
@@ -43,7 +43,7 @@ def one_shot_ocr_service(image, output):
             prediction["text"] = extracted_text
             bounding_box = [coordinates[el] for el in bounding_box_order]
             prediction["box"] = bounding_box
-            prediction["score"] = valid_df["conf"].mean()/100.0
+            prediction["score"] = float(valid_df["conf"].mean()/100.0)
 
             response.append(prediction)
 
@@ -81,6 +81,6 @@ def ocr_service(image):
     response = {}
     response["text"] = extracted_text
     response["box"] = bounding_box
-    response["score"] = valid_df["conf"].mean()/100.0
+    response["score"] = float(valid_df["conf"].mean()/100.0)
 
     return [response]
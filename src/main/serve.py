@@ -0,0 +1,14 @@
+"""
+Launcher of the inference API.
+
+Run with `python serve.py` to serve the app with uvicorn on the uvloop event loop and the httptools http parser,
+both of which must be installed (see docker/requirements.txt). The number of worker processes is read from WORKERS.
+The app is imported by uvicorn only, this module doesn't import start.py so that it isn't initialized twice.
+"""
+import os
+import uvicorn
+from cpu_config import workers
+
+if __name__ == '__main__':
+	uvicorn.run('start:app', host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 4343)),
+				loop='uvloop', http='httptools', workers=workers)
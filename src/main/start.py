@@ -1,34 +1,66 @@
-import sys
+"""
+Inference API, served with uvicorn by serve.py.
+"""
+import os
+import asyncio
+import cv2
+import numpy as np
 from typing import List
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from models import ApiResponse
+from batching import MicroBatcher
 from inference.errors import Error
-from starlette.responses import FileResponse
-from starlette.staticfiles import StaticFiles
-from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.formparsers import MultiPartParser
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from deep_learning_service import DeepLearningService
 from fastapi import FastAPI, Form, File, UploadFile, Header, HTTPException
-from inference.exceptions import ModelNotFound, InvalidModelConfiguration, ApplicationError, ModelNotLoaded, \
-    InferenceEngineNotFound, InvalidInputData
+from fastapi.responses import ORJSONResponse
+from inference.exceptions import ApplicationError, InvalidInputData, ModelNotFound
 from ocr import ocr_service, one_shot_ocr_service
-from datetime import datetime
-import pytz
-from PIL import Image
+from cpu_config import physical_cores, intra_op_threads, inter_op_threads
 
-sys.path.append('./inference')
-
-tz = pytz.timezone("Europe/Berlin")
-
-dl_service = DeepLearningService()
+# models providing a quantized graph use it instead of the float one
+use_int8 = os.environ.get('USE_INT8', '0') == '1'
+dl_service = DeepLearningService(intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+								 use_int8=use_int8)
 error_logging = Error()
+# image decoding and pytesseract are blocking, they run on this pool to keep the event loop responsive. The pool is
+# sized from the physical cores the API is pinned to, not from the logical cpus.
+image_executor = ThreadPoolExecutor(max_workers=max(1, physical_cores // 2))
+# uploads bigger than this are spooled to a temporary file, keep typical images in memory. The setting moved from
+# UploadFile to MultiPartParser between starlette versions.
+upload_max_memory_size = int(os.environ.get('UPLOAD_MAX_MEMORY_SIZE_MB', 16)) * 1024 * 1024
+StarletteUploadFile.spool_max_size = upload_max_memory_size
+MultiPartParser.max_file_size = upload_max_memory_size
+# loading models is heavy and blocking, loads run one at a time on a dedicated thread
+load_executor = ThreadPoolExecutor(max_workers=1)
+load_lock = asyncio.Lock()
+# predictions run on this pool, off the event loop, with as many concurrent session runs as inter op threads
+infer_executor = ThreadPoolExecutor(max_workers=max(1, inter_op_threads))
+# prediction functions bound to the loaded models, by model name
+bound_models = {}
+# concurrent single image predictions on the same model are grouped and run as one batch
+batch_max_size = int(os.environ.get('BATCH_MAX_SIZE', 8))
+batch_max_delay = int(os.environ.get('BATCH_MAX_DELAY_MS', 10)) / 1000
+batchers = {}
+# models metadata (labels, configuration, available models) only changes when models are (re)loaded
+metadata_cache = {}
+# models are loaded on startup, so that the first requests don't pay for the graph initialization
+warm_up_models = os.environ.get('WARM_UP_MODELS', '1') == '1'
 app = FastAPI(version='1.0', title='BMW InnovationLab tensorflow cpu inference Automation',
+			  default_response_class=ORJSONResponse,
 			  description="<b>API for performing tensorflow cpu inference</b></br></br>"
 						  "<b>Contact the developers:</b></br>"
 						  "<b>Antoine Charbel: <a href='mailto:antoine.charbel@inmind.ai'>antoine.charbel@inmind.ai</a></b></br>"
 						  "<b>BMW Innovation Lab: <a href='mailto:innovation-lab@bmw.de'>innovation-lab@bmw.de</a></b>")
 
 
+# from starlette.staticfiles import StaticFiles
 # app.mount("/public", StaticFiles(directory="/main/public"), name="public")
 
+# from starlette.middleware.cors import CORSMiddleware
 # app.add_middleware(
 #     CORSMiddleware,
 #     allow_origins=["*"],
@@ -38,14 +70,188 @@ app = FastAPI(version='1.0', title='BMW InnovationLab tensorflow cpu inference A
 # )
 
 
+def _decode_rgb(image_bytes):
+	"""
+	Decodes an uploaded image with opencv, which is much faster than pillow on large images.
+	The exif orientation is ignored to keep the same coordinates as the original image.
+	:param image_bytes: Encoded image
+	:return: RGB image as a numpy array
+	"""
+	image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+	if image is None:
+		raise InvalidInputData('corrupted image')
+	# swap the channels in place to avoid allocating a second full resolution image
+	return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+async def _read_image(image):
+	"""
+	Reads an uploaded image in memory and decodes it off the event loop.
+	The decoded image is passed to the models instead of the uploaded file.
+	:param image: Uploaded image file
+	:return: RGB image as a numpy array
+	"""
+	loop = asyncio.get_event_loop()
+	return await loop.run_in_executor(image_executor, _decode_rgb, await image.read())
+
+
+def _bind_models():
+	"""
+	Binds the prediction function of every loaded model to its name, so predictions skip the model lookup.
+	Called after models are (re)loaded, since a reloaded model replaces the previous instance.
+	"""
+	bound_models.clear()
+	for model_name in list(dl_service.models_dict):
+		bound_models[model_name] = dl_service.get_callable(model_name)
+	# the batchers run the bound functions directly, they are bound to the reloaded models too
+	for model_name, batcher in batchers.items():
+		if model_name in bound_models:
+			batcher.run_batch = partial(_run_prediction, bound_models[model_name])
+
+
+async def _load_model(model_name):
+	"""
+	Loads a model in case it wasn't loaded yet. The load runs on the loading thread, like the /load endpoints do, so
+	that the event loop isn't blocked and the same model isn't loaded twice.
+	:param model_name: Model name
+	"""
+	if not dl_service.model_loaded(model_name):
+		async with load_lock:
+			if not dl_service.model_loaded(model_name):
+				loop = asyncio.get_event_loop()
+				await loop.run_in_executor(load_executor, dl_service.load_model, model_name)
+
+
+async def _get_callable(model_name):
+	"""
+	Returns the prediction function bound to a model, and loads the model in case it wasn't loaded yet.
+	The model hash is only resolved when the name isn't bound, model names skip the hash parsing.
+	:param model_name: Model name or model hash
+	:return: Function taking a list of RGB images as numpy arrays and returning a list of responses
+	"""
+	predict = bound_models.get(model_name)
+	if predict is None:
+		model_name = dl_service.resolve(model_name)
+		if model_name not in bound_models:
+			await _load_model(model_name)
+			bound_models[model_name] = dl_service.get_callable(model_name)
+		predict = bound_models[model_name]
+	return predict
+
+
+async def _run_prediction(predict, images):
+	"""
+	Runs a bound prediction function on the inference pool.
+	:param predict: Prediction function bound to a model
+	:param images: List of RGB images as numpy arrays
+	:return: List of bounding boxes responses
+	"""
+	loop = asyncio.get_event_loop()
+	return await loop.run_in_executor(infer_executor, predict, images)
+
+
+async def _predict(model_name, images):
+	"""
+	Runs a prediction on the inference pool.
+	:param model_name: Model name or model hash
+	:param images: List of RGB images as numpy arrays
+	:return: List of bounding boxes responses
+	"""
+	return await _run_prediction(await _get_callable(model_name), images)
+
+
+async def _get_batcher(model_name):
+	"""
+	Returns the batcher grouping the single image predictions of a model, and creates it in case it doesn't exist.
+	The model is loaded before the batcher is created, so that unknown model names don't leave idle batchers behind,
+	and the batcher runs the model's bound prediction function without looking it up.
+	:param model_name: Model name
+	:return: MicroBatcher
+	"""
+	if model_name not in batchers:
+		predict = await _get_callable(model_name)
+		if model_name not in batchers:
+			run_batch = partial(_run_prediction, predict)
+			batchers[model_name] = MicroBatcher(run_batch, batch_max_size, batch_max_delay)
+	return batchers[model_name]
+
+
+async def _submit(model_name, image):
+	"""
+	Runs a single image prediction through the batcher of the model.
+	:param model_name: Model name or model hash
+	:param image: RGB image as a numpy array
+	:return: Bounding boxes response
+	"""
+	batcher = batchers.get(model_name)
+	if batcher is None:
+		# model names and hashes share the same batcher
+		batcher = await _get_batcher(dl_service.resolve(model_name))
+	return await batcher.submit(image)
+
+
+def _get_metadata(key, getter, *args):
+	"""
+	Returns a cached model metadata, and calls the getter in case it's not cached yet.
+	The cache is cleared every time models are loaded.
+	:param key: Cache key
+	:param getter: Function returning the metadata
+	:param args: Getter arguments
+	:return: Metadata
+	"""
+	if key not in metadata_cache:
+		metadata_cache[key] = getter(*args)
+	return metadata_cache[key]
+
+
+async def _get_model_metadata(key, getter, model_name):
+	"""
+	Returns a cached metadata of a model. On a cache miss, the model is loaded through the loading thread before
+	calling the getter, so that the getter doesn't load it on the event loop.
+	:param key: Cache key
+	:param getter: Function taking the model name and returning the metadata
+	:param model_name: Model name or model hash
+	:return: Metadata
+	"""
+	if key not in metadata_cache:
+		await _load_model(dl_service.resolve(model_name))
+	return _get_metadata(key, getter, model_name)
+
+
+@app.on_event('startup')
+async def warm_up():
+	"""
+	Loads all the available models on startup, so that the first requests don't pay for loading them. The inference
+	engine already runs the graph once on a sample image while loading it. A model failing to load is logged and
+	doesn't prevent the API from starting.
+	"""
+	if not warm_up_models:
+		return
+	try:
+		model_names = dl_service.list_models()
+	except Exception as e:
+		error_logging.error('warm up %s', e)
+		return
+	for model_name in model_names:
+		try:
+			await _get_callable(model_name)
+		except Exception as e:
+			error_logging.error('%s %s', model_name, e)
+
+
 @app.get('/load')
-def load_custom():
+async def load_custom():
 	"""
 	Loads all the available models.
 	:return: All the available models with their respective hashed values
 	"""
 	try:
-		return dl_service.load_all_models()
+		async with load_lock:
+			loop = asyncio.get_event_loop()
+			models_hash = await loop.run_in_executor(load_executor, dl_service.load_all_models)
+			metadata_cache.clear()
+			_bind_models()
+		return models_hash
 	except ApplicationError as e:
 		return ApiResponse(success=False, error=e)
 	except Exception:
@@ -60,28 +266,27 @@ async def detect_custom(model: str = Form(...), image: UploadFile = File(...)):
 	:param image: Image file
 	:return: Model's Bounding boxes
 	"""
-	draw_boxes = False
-	predict_batch = False
 	try:
-		output = await dl_service.run_model(model, image, draw_boxes, predict_batch)
-		error_logging.info('request successful;' + str(output))
+		output = await _submit(model, await _read_image(image))
+		error_logging.info('request successful;%s', output)
 		return output
 	except ApplicationError as e:
-		error_logging.warning(model + ';' + str(e))
+		error_logging.warning('%s;%s', model, e)
 		return ApiResponse(success=False, error=e)
 	except Exception as e:
-		error_logging.error(model + ' ' + str(e))
+		error_logging.error('%s %s', model, e)
 		return ApiResponse(success=False, error='unexpected server error')
 
 
 @app.post('/get_labels')
-def get_labels_custom(model: str = Form(...)):
+async def get_labels_custom(model: str = Form(...)):
 	"""
 	Lists the model's labels with their hashed values.
 	:param model: Model name or model hash
 	:return: A list of the model's labels with their hashed values
 	"""
-	return dl_service.get_labels_custom(model)
+	# the worker answering the request may not be the one that served /load, the model is loaded in case it's missing
+	return await _get_model_metadata(('labels_custom', model), dl_service.get_labels_custom, model)
 
 
 @app.get('/models/{model_name}/load')
@@ -93,7 +298,11 @@ async def load(model_name: str, force: bool = False):
 	:return: APIResponse
 	"""
 	try:
-		dl_service.load_model(model_name, force)
+		async with load_lock:
+			loop = asyncio.get_event_loop()
+			await loop.run_in_executor(load_executor, dl_service.load_model, model_name, force)
+			metadata_cache.clear()
+			_bind_models()
 		return ApiResponse(success=True)
 	except ApplicationError as e:
 		return ApiResponse(success=False, error=e)
@@ -106,7 +315,7 @@ async def list_models(user_agent: str = Header(None)):
 	:param user_agent:
 	:return: APIResponse
 	"""
-	return ApiResponse(data={'models': dl_service.list_models()})
+	return ApiResponse(data={'models': _get_metadata('models', dl_service.list_models)})
 
 
 @app.post('/models/{model_name}/predict')
@@ -118,14 +327,14 @@ async def run_model(model_name: str, input_data: UploadFile = File(...)):
 	:return: APIResponse containing the prediction's bounding boxes
 	"""
 	try:
-		output = await dl_service.run_model(model_name, input_data, draw=False, predict_batch=False)
-		error_logging.info('request successful;' + str(output))
+		output = await _submit(model_name, await _read_image(input_data))
+		error_logging.info('request successful;%s', output)
 		return ApiResponse(data=output)
 	except ApplicationError as e:
-		error_logging.warning(model_name + ';' + str(e))
+		error_logging.warning('%s;%s', model_name, e)
 		return ApiResponse(success=False, error=e)
 	except Exception as e:
-		error_logging.error(model_name + ' ' + str(e))
+		error_logging.error('%s %s', model_name, e)
 		return ApiResponse(success=False, error='unexpected server error')
 
 
@@ -138,18 +347,41 @@ async def run_model_batch(model_name: str, input_data: List[UploadFile] = File(.
 	:return: APIResponse containing prediction(s) bounding boxes
 	"""
 	try:
-		output = await dl_service.run_model(model_name, input_data, draw=False, predict_batch=True)
-		error_logging.info('request successful;' + str(output))
+		images = await asyncio.gather(*[_read_image(image) for image in input_data])
+		output = await _predict(model_name, images)
+		for image, prediction in zip(input_data, output):
+			prediction['ImageName'] = image.filename
+		error_logging.info('request successful;%s', output)
 		return ApiResponse(data=output)
 	except ApplicationError as e:
-		error_logging.warning(model_name + ';' + str(e))
+		error_logging.warning('%s;%s', model_name, e)
 		return ApiResponse(success=False, error=e)
 	except Exception as e:
-		print(e)
-		error_logging.error(model_name + ' ' + str(e))
+		error_logging.error('%s %s', model_name, e)
 		return ApiResponse(success=False, error='unexpected server error')
 
 
+def _encode_jpeg(image):
+	"""
+	Encodes an image in memory, so it can be returned without going through the disk.
+	:param image: RGB pillow image
+	:return: JPEG bytes
+	"""
+	return cv2.imencode('.jpg', cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))[1].tobytes()
+
+
+def _draw_jpeg(model_name, image, response):
+	"""
+	Draws the bounding boxes on the image with the model's drawing function, and encodes the result.
+	:param model_name: Model name
+	:param image: RGB image as a numpy array
+	:param response: Bounding boxes response
+	:return: JPEG bytes
+	"""
+	from PIL import Image
+	return _encode_jpeg(dl_service.models_dict[model_name].draw_image(Image.fromarray(image), response))
+
+
 @app.post('/models/{model_name}/predict_image')
 async def predict_image(model_name: str, input_data: UploadFile = File(...)):
 	"""
@@ -159,14 +391,18 @@ async def predict_image(model_name: str, input_data: UploadFile = File(...)):
 	:return: Image file
 	"""
 	try:
-		output = await dl_service.run_model(model_name, input_data, draw=True, predict_batch=False)
-		error_logging.info('request successful;' + str(output))
-		return FileResponse("/main/result.jpg", media_type="image/jpg")
+		model_name = dl_service.resolve(model_name)
+		image = await _read_image(input_data)
+		output = (await _predict(model_name, [image]))[0]
+		loop = asyncio.get_event_loop()
+		content = await loop.run_in_executor(image_executor, _draw_jpeg, model_name, image, output)
+		error_logging.info('request successful')
+		return Response(content=content, media_type="image/jpeg")
 	except ApplicationError as e:
-		error_logging.warning(model_name + ';' + str(e))
+		error_logging.warning('%s;%s', model_name, e)
 		return ApiResponse(success=False, error=e)
 	except Exception as e:
-		error_logging.error(model_name + ' ' + str(e))
+		error_logging.error('%s %s', model_name, e)
 		return ApiResponse(success=False, error='unexpected server error')
 
 
@@ -177,7 +413,7 @@ async def list_model_labels(model_name: str):
 	:param model_name: Model name
 	:return: List of model's labels
 	"""
-	labels = dl_service.get_labels(model_name)
+	labels = await _get_model_metadata(('labels', model_name), dl_service.get_labels, model_name)
 	return ApiResponse(data=labels)
 
 
@@ -188,10 +424,31 @@ async def list_model_config(model_name: str):
 	:param model_name: Model name
 	:return: List of model's configuration
 	"""
-	config = dl_service.get_config(model_name)
+	config = await _get_model_metadata(('config', model_name), dl_service.get_config, model_name)
 	return ApiResponse(data=config)
 
 
+def _run_one_shot_ocr_sync(image, output_data):
+    """
+    Extracts the text inside the detected bounding boxes.
+    :param image: RGB image as a numpy array
+    :param output_data: Detection model's response
+    :return: Text fields with the detected boxes
+    """
+    from PIL import Image
+    return one_shot_ocr_service(Image.fromarray(image), output_data)
+
+
+def _run_ocr_sync(image_bytes):
+    """
+    Decodes the image and extracts the text it contains.
+    :param image_bytes: Encoded image
+    :return: Text fields found in the image
+    """
+    from PIL import Image
+    return ocr_service(Image.fromarray(_decode_rgb(image_bytes)))
+
+
 @app.post('/models/{model_name}/one_shot_ocr')
 async def one_shot_ocr(
     model_name: str,
@@ -210,19 +467,31 @@ async def one_shot_ocr(
         :return: Text fields with the detected files inside
 
     """
+    loop = asyncio.get_event_loop()
     output = None
-    # call detection on image with choosen model
+    # decode the image once, it is shared by the detection and the ocr, and call detection with choosen model
     try:
-        output = await run_model(model_name, image)
-    except:
-        raise HTTPException(status_code=404, detail='Invalid Model')
+        image = await _read_image(image)
+        output = await _submit(model_name, image)
+    except ModelNotFound as e:
+        error_logging.warning('%s;%s', model_name, e)
+        raise HTTPException(status_code=404, detail=str(e))
+    except InvalidInputData as e:
+        error_logging.warning('%s;%s', model_name, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ApplicationError as e:
+        error_logging.error('%s %s', model_name, e)
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        error_logging.error('%s %s', model_name, e)
+        raise HTTPException(status_code=500, detail='unexpected server error')
 
     # run ocr_service
     response = None
     try:
-        image = Image.open(image.file).convert('RGB')
-        response = one_shot_ocr_service(image, output.data)
-    except:
+        response = await loop.run_in_executor(image_executor, _run_one_shot_ocr_sync, image, output)
+    except Exception as e:
+        error_logging.error('%s %s', model_name, e)
         raise HTTPException(
             status_code=500, detail='Unexpected Error during Inference (Determination of Texts)')
 
@@ -254,8 +523,8 @@ async def optical_character_recognition(
     # run ocr_service
     response = None
     try:
-        image = Image.open(image.file).convert('RGB')
-        response = ocr_service(image)
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(image_executor, _run_ocr_sync, await image.read())
     except:
         raise HTTPException(
             status_code=500, detail='Unexpected Error during Inference (Determination of Texts)')
@@ -265,3 +534,4 @@ async def optical_character_recognition(
             status_code=400, detail='Inference (Determination of Texts) is not Possible with the Specified Model')
 
     return response
+
@@ -0,0 +1,107 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+from batching import MicroBatcher
+
+
+class MicroBatcherTest(unittest.TestCase):
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.batches = []
+		self.batchers = []
+
+	def tearDown(self):
+		# let the closed batchers' workers finish before closing the loop
+		for batcher in self.batchers:
+			batcher.close()
+		workers = [batcher.worker for batcher in self.batchers if batcher.worker is not None]
+		self.loop.run_until_complete(asyncio.gather(*workers, return_exceptions=True))
+		self.loop.close()
+		asyncio.set_event_loop(None)
+
+	def batcher(self, max_batch_size=8, max_batch_delay=0.01):
+		batcher = MicroBatcher(self.double, max_batch_size, max_batch_delay)
+		self.batchers.append(batcher)
+		return batcher
+
+	async def double(self, inputs):
+		self.batches.append(list(inputs))
+		await asyncio.sleep(0)
+		if any(input_data < 0 for input_data in inputs):
+			raise ValueError('negative input')
+		return [input_data * 2 for input_data in inputs]
+
+	def test_concurrent_inputs_are_batched(self):
+		batcher = self.batcher(max_batch_size=3)
+
+		async def run():
+			return await asyncio.gather(*[batcher.submit(i) for i in range(5)])
+
+		self.assertEqual(self.loop.run_until_complete(run()), [0, 2, 4, 6, 8])
+		# the inputs queued together are grouped in batches of at most max_batch_size
+		self.assertEqual(self.batches, [[0, 1, 2], [3, 4]])
+
+	def test_single_input_is_not_delayed(self):
+		batcher = self.batcher(max_batch_delay=10)
+		output = self.loop.run_until_complete(asyncio.wait_for(batcher.submit(1), 1))
+		self.assertEqual(output, 2)
+
+	def test_failed_batch_is_retried_one_by_one(self):
+		batcher = self.batcher()
+
+		async def run():
+			return await asyncio.gather(*[batcher.submit(i) for i in [0, 1, -1, 2]], return_exceptions=True)
+
+		outputs = self.loop.run_until_complete(run())
+		self.assertEqual(outputs[:2], [0, 2])
+		self.assertIsInstance(outputs[2], ValueError)
+		self.assertEqual(outputs[3], 4)
+		self.assertEqual(self.batches, [[0, 1, -1, 2], [0], [1], [-1], [2]])
+
+	def test_cancelled_request_is_not_run(self):
+		batcher = self.batcher()
+
+		async def run():
+			first = asyncio.ensure_future(batcher.submit(1))
+			cancelled = asyncio.ensure_future(batcher.submit(2))
+			last = asyncio.ensure_future(batcher.submit(3))
+			await asyncio.sleep(0)
+			cancelled.cancel()
+			return await first, await last
+
+		self.assertEqual(self.loop.run_until_complete(run()), (2, 6))
+		self.assertEqual(self.batches, [[1, 3]])
+
+	def test_close_aborts_pending_requests(self):
+		batcher = self.batcher()
+
+		async def run():
+			requests = [asyncio.ensure_future(batcher.submit(i)) for i in range(3)]
+			await asyncio.sleep(0)
+			batcher.close(LookupError('closed'))
+			return await asyncio.gather(*requests, return_exceptions=True)
+
+		outputs = self.loop.run_until_complete(run())
+		self.assertTrue(all(isinstance(output, LookupError) for output in outputs))
+
+	def test_close_cancels_pending_requests(self):
+		batcher = self.batcher()
+
+		async def run():
+			request = asyncio.ensure_future(batcher.submit(1))
+			await asyncio.sleep(0)
+			batcher.close()
+			await asyncio.sleep(0)
+			return request
+
+		self.assertTrue(self.loop.run_until_complete(run()).cancelled())
+
+
+if __name__ == '__main__':
+	unittest.main()